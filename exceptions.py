@@ -4,3 +4,12 @@ class MissingEnvironmentVariableError(Exception):
 
 class InvalidResponseCodeError(Exception):
     """Исключение для неверного кода ответа API."""
+
+
+class TooManyRequestsError(InvalidResponseCodeError):
+    """Исключение для ответа API с кодом 429."""
+
+    def __init__(self, message, retry_after=None):
+        """Сохраняет паузу из заголовка Retry-After в секундах."""
+        super().__init__(message)
+        self.retry_after = retry_after
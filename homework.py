@@ -1,16 +1,27 @@
+import atexit
 import logging
 import os
+import queue
+import random
+import re
+import signal
 import sys
 import time
+from collections import deque
 from http import HTTPStatus
+from logging.handlers import QueueHandler, QueueListener
+from types import MappingProxyType
 
 from dotenv import load_dotenv
 import requests
+from requests.adapters import HTTPAdapter
 from telebot import TeleBot, apihelper
+from urllib3.util.retry import Retry
 
 from exceptions import (
     InvalidResponseCodeError,
     MissingEnvironmentVariableError,
+    TooManyRequestsError,
 )
 
 load_dotenv()
@@ -20,31 +31,109 @@ TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
 
 RETRY_PERIOD = 600
+MIN_RETRY_PERIOD = 60
+MAX_RETRY_PERIOD = 3600
+RETRY_JITTER = 30
+ERROR_REPEAT_PERIOD = 3600
+ERROR_HISTORY_SIZE = 50
+SENT_HISTORY_SIZE = 256
+MESSAGE_MAX_LENGTH = 4096
+MESSAGES_PER_BATCH = 10
+MESSAGE_SEPARATOR = '\n\n'
 ENDPOINT = 'https://practicum.yandex.ru/api/user_api/homework_statuses/'
 HEADERS = {'Authorization': f'OAuth {PRACTICUM_TOKEN}'}
+SAFE_HEADERS = {**HEADERS, 'Authorization': 'OAuth ***'}
+REQUEST_TIMEOUT = (5, 30)
+TELEGRAM_API_URL = 'https://api.telegram.org'
+# Худший случай отправки: две попытки подключения по 2 секунды,
+# пауза перед повтором до 0,5 секунды и 5 секунд на ответ — до 9,5 секунд.
+TELEGRAM_CONNECT_TIMEOUT = 2
+TELEGRAM_READ_TIMEOUT = 5
+TELEGRAM_CONNECT_RETRIES = 1
+TELEGRAM_RETRY_BACKOFF = 0.5
+_MISSING = object()
 
-HOMEWORK_VERDICTS = {
+HOMEWORK_VERDICTS = MappingProxyType({
     'approved': 'Работа проверена: ревьюеру всё понравилось. Ура!',
     'reviewing': 'Работа взята на проверку ревьюером.',
     'rejected': 'Работа проверена: у ревьюера есть замечания.'
-}
+})
+NOTIFY_VERDICTS = (
+    HOMEWORK_VERDICTS['approved'],
+    HOMEWORK_VERDICTS['rejected'],
+)
+HOMEWORK_MESSAGES = MappingProxyType({
+    status: f'Изменился статус проверки работы "{{name}}". {verdict}'
+    for status, verdict in HOMEWORK_VERDICTS.items()
+})
 
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'DEBUG').strip().upper()
+# OAuth-токен Практикума и токен бота из URL вида /bot<TOKEN>/sendMessage.
+TOKEN_PATTERN = re.compile(r'(OAuth )[A-Za-z0-9_\-.]+|(bot)\d+:[\w-]+')
 log_file_path = os.path.join(os.path.expanduser('~'), 'homework_log.log')
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s'
-    ' [%(levelname)s]'
-    ' %(filename)s:%(lineno)d'
-    ' - %(funcName)s()'
-    ' - %(message)s',
-    handlers=[
+
+class TokenFilter(logging.Filter):
+    """Маскирует токены Практикума и Telegram в записях лога."""
+
+    def filter(self, record):
+        """Подставляет аргументы в сообщение и скрывает токен."""
+        try:
+            message = record.getMessage()
+        except Exception:
+            # Ошибку форматирования сообщит Handler.handleError,
+            # из фильтра исключение ушло бы в вызывающий код.
+            return True
+        record.msg = TOKEN_PATTERN.sub(r'\1\2***', message)
+        record.args = None
+        return True
+
+
+logger = logging.getLogger(__name__)
+root_logger = logging.getLogger()
+
+# Как и basicConfig, настраиваем корневой логгер: в файл попадают и записи
+# urllib3 и pyTelegramBotAPI. При повторном импорте модуля логирование
+# уже настроено: не открываем файл лога второй раз и не запускаем ещё
+# один поток QueueListener.
+if not any(
+    isinstance(handler, QueueHandler) for handler in root_logger.handlers
+):
+    log_formatter = logging.Formatter(
+        '%(asctime)s'
+        ' [%(levelname)s]'
+        ' %(filename)s:%(lineno)d'
+        ' - %(funcName)s()'
+        ' - %(message)s'
+    )
+    log_handlers = (
         logging.FileHandler(log_file_path, encoding='utf-8'),
         logging.StreamHandler(sys.stdout)
-    ]
-)
+    )
+    for log_handler in log_handlers:
+        log_handler.setFormatter(log_formatter)
 
-logger = logging.getLogger(__name__)
+    # Запись в файл и в stdout выполняет фоновый поток QueueListener,
+    # основной цикл бота только кладёт записи в очередь.
+    log_queue = queue.SimpleQueue()
+    log_listener = QueueListener(log_queue, *log_handlers)
+    log_listener.start()
+    atexit.register(log_listener.stop)
+
+    # Фильтр на обработчике, а не на логгере: так токены маскируются
+    # во всех записях, включая пришедшие от других логгеров.
+    log_queue_handler = QueueHandler(log_queue)
+    log_queue_handler.addFilter(TokenFilter())
+    root_logger.addHandler(log_queue_handler)
+    if isinstance(logging.getLevelName(LOG_LEVEL), int):
+        root_logger.setLevel(LOG_LEVEL)
+    else:
+        root_logger.setLevel(logging.DEBUG)
+        logger.warning(
+            'Неизвестный уровень логирования LOG_LEVEL=%s, '
+            'используется DEBUG',
+            LOG_LEVEL
+        )
 
 
 def check_tokens():
@@ -57,7 +146,7 @@ def check_tokens():
     missing_tokens = []
     for name, token in tokens:
         if not token:
-            logger.critical(f'Отсутствует токен: {name}')
+            logger.critical('Отсутствует токен: %s', name)
             missing_tokens.append(name)
     if missing_tokens:
         missing_tokens_str = ', '.join(missing_tokens)
@@ -69,30 +158,36 @@ def check_tokens():
 
 def get_api_answer(timestamp):
     """Делает запрос к API и возвращает ответ, преобразованный из JSON."""
-    request_params = {
-        'url': ENDPOINT,
-        'headers': HEADERS,
-        'params': {'from_date': timestamp}
-    }
-
-    logger.debug(
-        'Начало запроса к API: '
-        'URL={url}, Headers={headers}, Params={params}'.format(
-            **request_params
-        )
-    )
+    params = {'from_date': timestamp}
+    logger.debug('Начало запроса к API: URL=%s, Params=%s', ENDPOINT, params)
 
     try:
-        response = requests.get(**request_params)
+        response = requests.get(
+            ENDPOINT,
+            headers=HEADERS,
+            params=params,
+            timeout=REQUEST_TIMEOUT
+        )
     except requests.RequestException as error:
         raise ConnectionError(
             'Сбой при запросе к API: URL={url},'
             ' Headers={headers},'
             ' Params={params},'
             ' Ошибка: {error}'.format(
-                **request_params, error=error
+                url=ENDPOINT,
+                headers=SAFE_HEADERS,
+                params=params,
+                error=error
             )
         )
+    if response.status_code == HTTPStatus.TOO_MANY_REQUESTS:
+        retry_after = response.headers.get('Retry-After', '')
+        raise TooManyRequestsError(
+            'API ограничил частоту запросов: Retry-After={retry_after}'.format(
+                retry_after=retry_after
+            ),
+            retry_after=int(retry_after) if retry_after.isdigit() else None
+        )
     if response.status_code != HTTPStatus.OK:
         raise InvalidResponseCodeError(
             'API вернул код, отличный от 200: Код ответа={status_code},'
@@ -110,9 +205,9 @@ def check_response(response):
     """Проверяет ответ API на соответствие ожидаемой структуре."""
     if not isinstance(response, dict):
         raise TypeError('Ответ API должен быть словарем.')
-    if 'homeworks' not in response:
+    homeworks = response.get('homeworks', _MISSING)
+    if homeworks is _MISSING:
         raise KeyError('В ответе API отсутствует ключ "homeworks".')
-    homeworks = response['homeworks']
     if not isinstance(homeworks, list):
         raise TypeError('Значение по ключу "homeworks" должно быть списком.')
     return homeworks
@@ -120,39 +215,163 @@ def check_response(response):
 
 def parse_status(homework):
     """Извлекает статус домашней работы и возвращает строку с вердиктом."""
-    if 'status' not in homework:
-        raise KeyError(
-            'В информации о домашней работе отсутствует ключ "status".'
-        )
-    if 'homework_name' not in homework:
+    try:
+        status = homework['status']
+        homework_name = homework['homework_name']
+    except KeyError as error:
         raise KeyError(
-            'В информации о домашней работе отсутствует ключ "homework_name".'
-        )
-    status = homework['status']
-    homework_name = homework['homework_name']
-    if status not in HOMEWORK_VERDICTS:
-        raise ValueError(f'Неизвестный статус домашней работы: {status}')
-    verdict = HOMEWORK_VERDICTS[status]
-    return f'Изменился статус проверки работы "{homework_name}". {verdict}'
+            'В информации о домашней работе отсутствует ключ '
+            f'"{error.args[0]}".'
+        ) from None
+    try:
+        template = HOMEWORK_MESSAGES[status]
+    except KeyError:
+        raise ValueError(
+            f'Неизвестный статус домашней работы: {status}'
+        ) from None
+    return template.format(name=homework_name)
+
+
+def get_status_key(homework):
+    """Возвращает ключ, уникальный для каждой смены статуса работы."""
+    return (
+        homework.get('id', homework.get('homework_name')),
+        homework.get('status'),
+        homework.get('date_updated'),
+    )
 
 
 def send_message(bot, message):
     """Отправляет сообщение в Telegram чат и возвращает статус отправки."""
     try:
-        bot.send_message(TELEGRAM_CHAT_ID, message)
-        logger.debug(f'Бот отправил сообщение: "{message}"')
+        bot.send_message(
+            TELEGRAM_CHAT_ID,
+            message,
+            disable_web_page_preview=True,
+            disable_notification=not any(
+                verdict in message for verdict in NOTIFY_VERDICTS
+            )
+        )
+        logger.debug('Бот отправил сообщение: "%s"', message)
         return True
-    except apihelper.ApiException as error:
-        logger.error(f'Сбой при отправке сообщения в Telegram: {error}')
+    except (apihelper.ApiException, requests.RequestException) as error:
+        logger.error('Сбой при отправке сообщения в Telegram: %s', error)
         return False
 
 
+def split_updates(updates):
+    """Разбивает обновления на пачки, которые влезают в одно сообщение."""
+    batch = []
+    length = 0
+    for key, message in updates:
+        message = message[:MESSAGE_MAX_LENGTH]
+        added = len(message) + (len(MESSAGE_SEPARATOR) if batch else 0)
+        if batch and (
+            len(batch) == MESSAGES_PER_BATCH
+            or length + added > MESSAGE_MAX_LENGTH
+        ):
+            yield batch
+            batch = []
+            length = 0
+            added = len(message)
+        batch.append((key, message))
+        length += added
+    if batch:
+        yield batch
+
+
+def send_updates(bot, updates, sent_updates):
+    """Отправляет обновления пачками и сообщает, доставлены ли все."""
+    for batch in split_updates(updates):
+        message = MESSAGE_SEPARATOR.join(message for _, message in batch)
+        if not send_message(bot, message):
+            return False
+        sent_updates.extend(key for key, _ in batch)
+    return True
+
+
+def get_poll_period(homeworks, poll_period):
+    """Возвращает интервал до следующего опроса API.
+
+    Пока работа на ревью, вердикт ожидается скоро: опрашиваем API
+    чаще и удваиваем интервал после каждого пустого ответа.
+    """
+    if not homeworks:
+        return min(poll_period * 2, RETRY_PERIOD)
+    if any(homework.get('status') == 'reviewing' for homework in homeworks):
+        return MIN_RETRY_PERIOD
+    return RETRY_PERIOD
+
+
+def get_retry_period(error, fail_count):
+    """Возвращает паузу перед повторным запросом после сбоя."""
+    retry_after = getattr(error, 'retry_after', None)
+    if retry_after is not None:
+        return min(max(retry_after, MIN_RETRY_PERIOD), MAX_RETRY_PERIOD)
+    return (
+        min(RETRY_PERIOD * 2 ** fail_count, MAX_RETRY_PERIOD)
+        + random.uniform(0, RETRY_JITTER)
+    )
+
+
+def is_error_reported(error_key, reported_errors):
+    """Проверяет, сообщалось ли об ошибке этого типа за последний час."""
+    now = time.monotonic()
+    return any(
+        key == error_key and now - reported_at < ERROR_REPEAT_PERIOD
+        for reported_at, key in reported_errors
+    )
+
+
+def report_error(bot, error, reported_errors):
+    """Логирует сбой и сообщает о нём в Telegram не чаще раза в час."""
+    message = f'Сбой в работе программы: {error}'
+    logger.exception(message)
+    error_key = type(error).__name__
+    if (
+        not is_error_reported(error_key, reported_errors)
+        and send_message(bot, message)
+    ):
+        reported_errors.append((time.monotonic(), error_key))
+
+
+def handle_sigterm(signum, frame):
+    """Завершает работу бота по сигналу SIGTERM."""
+    logger.info('Получен сигнал SIGTERM, бот останавливается')
+    sys.exit(0)
+
+
+def get_telegram_session():
+    """Создаёт HTTP-сессию с отдельным пулом соединений для Telegram."""
+    session = requests.Session()
+    # Повторяем только неудавшиеся подключения: запрос до сервера
+    # не дошёл, поэтому повтор не продублирует сообщение.
+    session.mount(TELEGRAM_API_URL, HTTPAdapter(
+        pool_maxsize=1,
+        max_retries=Retry(
+            connect=TELEGRAM_CONNECT_RETRIES,
+            read=0,
+            backoff_factor=TELEGRAM_RETRY_BACKOFF
+        )
+    ))
+    return session
+
+
 def main():
     """Основная логика работы бота."""
     check_tokens()
+    # pyTelegramBotAPI использует переданную сессию и после истечения
+    # SESSION_TIME_TO_LIVE, поэтому пул соединений с Telegram живёт
+    # всё время работы бота.
+    apihelper.session = get_telegram_session()
+    apihelper.CONNECT_TIMEOUT = TELEGRAM_CONNECT_TIMEOUT
+    apihelper.READ_TIMEOUT = TELEGRAM_READ_TIMEOUT
     bot = TeleBot(token=TELEGRAM_TOKEN)
     current_timestamp = int(time.time())
-    last_message = ''
+    sent_updates = deque(maxlen=SENT_HISTORY_SIZE)
+    reported_errors = deque(maxlen=ERROR_HISTORY_SIZE)
+    fail_count = 0
+    poll_period = RETRY_PERIOD
 
     while True:
         try:
@@ -160,27 +379,40 @@ def main():
             homeworks = check_response(response)
             if not homeworks:
                 logger.debug('Новые статусы в ответе отсутствуют')
-                continue
-
-            homework = homeworks[0]
-            message = parse_status(homework)
-
-            if message != last_message and send_message(bot, message):
-                last_message = message
-                current_timestamp = response.get(
-                    'current_date',
-                    current_timestamp
-                )
+            else:
+                updates = []
+                for homework in homeworks:
+                    # Одна некорректная работа не должна задерживать
+                    # отправку остальных вердиктов из того же ответа.
+                    try:
+                        updates.append(
+                            (get_status_key(homework), parse_status(homework))
+                        )
+                    except Exception as error:
+                        report_error(bot, error, reported_errors)
+                new_updates = [
+                    (key, message) for key, message in updates
+                    if key not in sent_updates
+                ]
+                if send_updates(bot, new_updates, sent_updates):
+                    current_timestamp = response.get(
+                        'current_date',
+                        current_timestamp
+                    )
 
         except Exception as error:
-            message = f'Сбой в работе программы: {error}'
-            logger.exception(message)
-            if message != last_message and send_message(bot, message):
-                last_message = message
+            report_error(bot, error, reported_errors)
+            retry_period = get_retry_period(error, fail_count)
+            fail_count += 1
+
+        else:
+            fail_count = 0
+            poll_period = get_poll_period(homeworks, poll_period)
+            retry_period = poll_period
 
-        finally:
-            time.sleep(RETRY_PERIOD)
+        time.sleep(retry_period)
 
 
 if __name__ == '__main__':
+    signal.signal(signal.SIGTERM, handle_sigterm)
     main()
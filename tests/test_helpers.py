@@ -0,0 +1,455 @@
+import importlib
+import logging
+from http import HTTPStatus
+from logging.handlers import QueueHandler
+
+import pytest
+import requests
+import telebot
+
+from exceptions import InvalidResponseCodeError, TooManyRequestsError
+
+
+class StopLoop(BaseException):
+    pass
+
+
+class RecordingBot:
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.attempts = []
+        self.sent = []
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.attempts.append(text)
+        if self.failures and self.failures.pop(0):
+            raise telebot.apihelper.ApiException(
+                'Telegram недоступен', 'send_message', 500
+            )
+        self.sent.append(text)
+
+
+def run_main(monkeypatch, homework_module, answers, bot):
+    """Run main() over the given API answers; return requested from_date."""
+    requested = []
+
+    def mock_get_api_answer(timestamp):
+        requested.append(timestamp)
+        answer = answers[len(requested) - 1]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    def mock_sleep(secs):
+        if len(requested) == len(answers):
+            raise StopLoop
+
+    monkeypatch.setattr(homework_module, 'PRACTICUM_TOKEN', 'sometoken')
+    monkeypatch.setattr(homework_module, 'TELEGRAM_TOKEN', '1234:abcdefg')
+    monkeypatch.setattr(homework_module, 'TELEGRAM_CHAT_ID', '12345')
+    monkeypatch.setattr(homework_module, 'get_api_answer', mock_get_api_answer)
+    monkeypatch.setattr(homework_module, 'TeleBot', lambda token: bot)
+    monkeypatch.setattr(homework_module.time, 'sleep', mock_sleep)
+    monkeypatch.setattr(homework_module.apihelper, 'session', None)
+    for name in ('SESSION_TIME_TO_LIVE', 'CONNECT_TIMEOUT', 'READ_TIMEOUT'):
+        monkeypatch.setattr(
+            homework_module.apihelper,
+            name,
+            getattr(homework_module.apihelper, name)
+        )
+    with pytest.raises(StopLoop):
+        homework_module.main()
+    return requested
+
+
+class MockResponse429:
+    status_code = HTTPStatus.TOO_MANY_REQUESTS
+    reason = 'Too Many Requests'
+    text = ''
+
+    def __init__(self, retry_after=None):
+        self.headers = {}
+        if retry_after is not None:
+            self.headers['Retry-After'] = retry_after
+
+
+class TestRetryPeriod:
+
+    def test_retry_period_grows_with_fail_count(
+            self, monkeypatch, homework_module
+    ):
+        monkeypatch.setattr(homework_module.random, 'uniform', lambda a, b: 0)
+        error = InvalidResponseCodeError('500')
+        periods = [
+            homework_module.get_retry_period(error, fail_count)
+            for fail_count in range(4)
+        ]
+        assert periods == [600, 1200, 2400, homework_module.MAX_RETRY_PERIOD]
+
+    def test_retry_period_is_capped_with_jitter(self, homework_module):
+        error = InvalidResponseCodeError('500')
+        for _ in range(20):
+            period = homework_module.get_retry_period(error, 10)
+            assert (
+                homework_module.MAX_RETRY_PERIOD
+                <= period
+                <= homework_module.MAX_RETRY_PERIOD
+                + homework_module.RETRY_JITTER
+            )
+
+    @pytest.mark.parametrize('retry_after, expected', [
+        (120, 120),
+        (0, 60),
+        (1, 60),
+        (100000, 3600),
+    ])
+    def test_retry_after_is_clamped(
+            self, retry_after, expected, homework_module
+    ):
+        error = TooManyRequestsError('429', retry_after=retry_after)
+        assert homework_module.get_retry_period(error, 5) == expected
+
+
+class TestPollPeriod:
+
+    def test_poll_period_doubles_after_review(self, homework_module):
+        poll_period = homework_module.get_poll_period(
+            [{'homework_name': 'hw', 'status': 'reviewing'}],
+            homework_module.RETRY_PERIOD
+        )
+        periods = [poll_period]
+        for _ in range(5):
+            poll_period = homework_module.get_poll_period([], poll_period)
+            periods.append(poll_period)
+        assert periods == [60, 120, 240, 480, 600, 600]
+
+    def test_poll_period_after_final_verdict(self, homework_module):
+        assert homework_module.get_poll_period(
+            [{'homework_name': 'hw', 'status': 'approved'}],
+            homework_module.MIN_RETRY_PERIOD
+        ) == homework_module.RETRY_PERIOD
+
+
+class TestErrorReported:
+
+    def test_error_reported_within_window(self, monkeypatch, homework_module):
+        monkeypatch.setattr(homework_module.time, 'monotonic', lambda: 5000)
+        reported_errors = [(4000, 'ConnectionError')]
+        assert homework_module.is_error_reported(
+            'ConnectionError', reported_errors
+        )
+        assert not homework_module.is_error_reported(
+            'TypeError', reported_errors
+        )
+
+    def test_error_report_expires(self, monkeypatch, homework_module):
+        monkeypatch.setattr(
+            homework_module.time,
+            'monotonic',
+            lambda: 1000 + homework_module.ERROR_REPEAT_PERIOD
+        )
+        assert not homework_module.is_error_reported(
+            'ConnectionError', [(1000, 'ConnectionError')]
+        )
+
+
+class TestTooManyRequests:
+
+    @pytest.mark.parametrize('header, retry_after', [
+        ('120', 120),
+        ('Wed, 21 Oct 2015 07:28:00 GMT', None),
+        (None, None),
+    ])
+    def test_429_raises_too_many_requests(
+            self, monkeypatch, header, retry_after, homework_module
+    ):
+        monkeypatch.setattr(
+            requests, 'get', lambda *args, **kwargs: MockResponse429(header)
+        )
+        with pytest.raises(TooManyRequestsError) as error:
+            homework_module.get_api_answer(0)
+        assert error.value.retry_after == retry_after
+
+
+class TestMainErrors:
+
+    def test_repeated_error_is_logged_but_not_sent(
+            self, monkeypatch, caplog, homework_module
+    ):
+        bot = RecordingBot()
+        with caplog.at_level(logging.ERROR):
+            run_main(monkeypatch, homework_module, [
+                InvalidResponseCodeError('Код ответа=500'),
+                InvalidResponseCodeError('Код ответа=502'),
+            ], bot)
+        error_records = [
+            record for record in caplog.records
+            if 'Сбой в работе программы' in record.getMessage()
+        ]
+        assert len(error_records) == 2
+        assert len(bot.sent) == 1
+        assert 'Код ответа=500' in bot.sent[0]
+
+    def test_error_with_failed_send_is_retried(
+            self, monkeypatch, homework_module
+    ):
+        bot = RecordingBot(failures=[True, False])
+        run_main(monkeypatch, homework_module, [
+            InvalidResponseCodeError('Код ответа=500'),
+            InvalidResponseCodeError('Код ответа=500'),
+        ], bot)
+        assert len(bot.attempts) == 2
+        assert len(bot.sent) == 1
+
+
+def make_answer(current_date, *statuses):
+    return {
+        'homeworks': [
+            {
+                'id': 1,
+                'homework_name': 'hw.zip',
+                'status': status,
+                'date_updated': date_updated,
+            }
+            for status, date_updated in statuses
+        ],
+        'current_date': current_date,
+    }
+
+
+class TestMainStatuses:
+
+    def test_resubmitted_homework_is_reported_again(
+            self, monkeypatch, homework_module
+    ):
+        bot = RecordingBot()
+        requested = run_main(monkeypatch, homework_module, [
+            make_answer(100, ('reviewing', '2024-01-01T10:00:00Z')),
+            make_answer(200, ('rejected', '2024-01-02T10:00:00Z')),
+            make_answer(300, ('reviewing', '2024-01-03T10:00:00Z')),
+            make_answer(400, ('rejected', '2024-01-04T10:00:00Z')),
+        ], bot)
+        verdicts = homework_module.HOMEWORK_VERDICTS
+        assert [message.rsplit('. ', 1)[1] for message in bot.sent] == [
+            verdicts['reviewing'],
+            verdicts['rejected'],
+            verdicts['reviewing'],
+            verdicts['rejected'],
+        ]
+        assert requested[1:] == [100, 200, 300]
+
+    def test_already_sent_status_is_not_repeated(
+            self, monkeypatch, homework_module
+    ):
+        bot = RecordingBot()
+        update = ('approved', '2024-01-01T10:00:00Z')
+        requested = run_main(monkeypatch, homework_module, [
+            make_answer(100, update),
+            make_answer(200, update),
+            make_answer(300),
+        ], bot)
+        assert len(bot.sent) == 1
+        assert requested[1:] == [100, 200]
+
+
+def make_many_homeworks_answer(current_date, count, name_length):
+    return {
+        'homeworks': [
+            {
+                'id': homework_id,
+                'homework_name': f'{homework_id}-' + 'x' * name_length,
+                'status': 'approved',
+                'date_updated': '2024-01-01T10:00:00Z',
+            }
+            for homework_id in range(count)
+        ],
+        'current_date': current_date,
+    }
+
+
+class TestMainBatches:
+
+    def test_batch_is_limited_by_message_count(
+            self, monkeypatch, homework_module
+    ):
+        bot = RecordingBot()
+        run_main(monkeypatch, homework_module, [
+            make_many_homeworks_answer(100, 25, 5),
+        ], bot)
+        assert [len(message.split('\n\n')) for message in bot.sent] == [
+            10, 10, 5
+        ]
+
+    def test_batch_fits_telegram_message_length(
+            self, monkeypatch, homework_module
+    ):
+        bot = RecordingBot()
+        run_main(monkeypatch, homework_module, [
+            make_many_homeworks_answer(100, 25, 500),
+        ], bot)
+        assert len(bot.sent) > 1
+        assert all(
+            len(message) <= homework_module.MESSAGE_MAX_LENGTH
+            for message in bot.sent
+        )
+        assert sum(len(message.split('\n\n')) for message in bot.sent) == 25
+
+    def test_from_date_advances_after_all_batches_delivered(
+            self, monkeypatch, homework_module
+    ):
+        bot = RecordingBot(failures=[False, True])
+        answer = make_many_homeworks_answer(100, 15, 5)
+        requested = run_main(monkeypatch, homework_module, [
+            answer, answer, make_answer(200),
+        ], bot)
+        assert requested[1] == requested[0]
+        assert requested[2] == 100
+        assert [len(message.split('\n\n')) for message in bot.sent] == [
+            10, 5
+        ]
+
+
+class TestTokenFilter:
+
+    def test_token_is_masked_in_lazy_call(
+            self, monkeypatch, homework_module
+    ):
+        queued = []
+        monkeypatch.setattr(
+            get_root_queue_handler(), 'enqueue', queued.append
+        )
+        homework_module.logger.info(
+            'Headers=%s', {'Authorization': 'OAuth y0_AgAAAA-secret.1'}
+        )
+        message = queued[-1].getMessage()
+        assert 'y0_AgAAAA-secret.1' not in message
+        assert 'OAuth ***' in message
+
+    def test_token_is_masked_in_formatted_call(
+            self, monkeypatch, homework_module
+    ):
+        token = 'y0_AgAAAA-secret.2'
+        queued = []
+        monkeypatch.setattr(
+            get_root_queue_handler(), 'enqueue', queued.append
+        )
+        homework_module.logger.info(f'Authorization: OAuth {token}')
+        assert queued[-1].getMessage() == 'Authorization: OAuth ***'
+
+    def test_token_is_masked_in_third_party_record(
+            self, monkeypatch, homework_module
+    ):
+        queued = []
+        monkeypatch.setattr(
+            get_root_queue_handler(), 'enqueue', queued.append
+        )
+        logging.getLogger('urllib3.connectionpool').warning(
+            'Authorization: %s', 'OAuth y0_AgAAAA-secret.3'
+        )
+        assert queued[-1].getMessage() == 'Authorization: OAuth ***'
+
+    def test_telegram_token_is_masked_in_failed_send(
+            self, monkeypatch, homework_module
+    ):
+        class ConnectionFailingBot:
+            def send_message(self, *args, **kwargs):
+                raise requests.ConnectionError(
+                    "HTTPSConnectionPool(host='api.telegram.org', port=443): "
+                    'Max retries exceeded with url: '
+                    '/bot1234:AAH-secret_token/sendMessage'
+                )
+
+        queued = []
+        monkeypatch.setattr(
+            get_root_queue_handler(), 'enqueue', queued.append
+        )
+        assert not homework_module.send_message(
+            ConnectionFailingBot(), 'message'
+        )
+        message = queued[-1].getMessage()
+        assert '1234:AAH-secret_token' not in message
+        assert '/bot***/sendMessage' in message
+
+    def test_bad_format_args_do_not_raise(self, homework_module):
+        record = logging.LogRecord(
+            'homework', logging.WARNING, __file__, 1, 'a %s %s', (1,), None
+        )
+        assert homework_module.TokenFilter().filter(record)
+        assert record.msg == 'a %s %s'
+        assert record.args == (1,)
+
+
+class TestTelegramSession:
+
+    def test_send_is_bounded_by_connect_retries(self, homework_module):
+        session = homework_module.get_telegram_session()
+        retries = session.get_adapter(
+            f'{homework_module.TELEGRAM_API_URL}/bot1/sendMessage'
+        ).max_retries
+        assert retries.connect == homework_module.TELEGRAM_CONNECT_RETRIES
+        assert retries.read == 0
+        worst_case = (
+            (retries.connect + 1) * homework_module.TELEGRAM_CONNECT_TIMEOUT
+            + retries.connect * homework_module.TELEGRAM_RETRY_BACKOFF
+            + homework_module.TELEGRAM_READ_TIMEOUT
+        )
+        assert worst_case <= 10
+
+
+class TestMainInvalidHomework:
+
+    def test_invalid_homework_does_not_block_others(
+            self, monkeypatch, homework_module
+    ):
+        bot = RecordingBot()
+        answer = make_answer(100, ('approved', '2024-01-01T10:00:00Z'))
+        answer['homeworks'].insert(0, {
+            'id': 2,
+            'homework_name': 'broken.zip',
+            'status': 'unknown',
+            'date_updated': '2024-01-01T10:00:00Z',
+        })
+        answer['homeworks'].append({'id': 3, 'status': 'approved'})
+        requested = run_main(monkeypatch, homework_module, [
+            answer, make_answer(200),
+        ], bot)
+        verdict = homework_module.HOMEWORK_VERDICTS['approved']
+        assert [message for message in bot.sent if verdict in message] == [
+            'Изменился статус проверки работы "hw.zip". ' + verdict
+        ]
+        assert any(
+            'Неизвестный статус домашней работы: unknown' in message
+            for message in bot.sent
+        )
+        assert requested[1] == 100
+
+
+def get_root_queue_handler():
+    return next(
+        handler for handler in logging.getLogger().handlers
+        if isinstance(handler, QueueHandler)
+    )
+
+
+class TestLogging:
+
+    def test_queue_handler_is_installed_once(self, homework_module):
+        importlib.reload(homework_module)
+        assert len([
+            handler for handler in logging.getLogger().handlers
+            if isinstance(handler, QueueHandler)
+        ]) == 1
+
+    def test_third_party_records_reach_log_queue(
+            self, monkeypatch, caplog, homework_module
+    ):
+        queued = []
+        monkeypatch.setattr(
+            get_root_queue_handler(), 'enqueue', queued.append
+        )
+        with caplog.at_level(logging.DEBUG):
+            logging.getLogger('urllib3.connectionpool').warning('Retrying')
+            logging.getLogger('TeleBot').error('Telegram error')
+        assert [record.getMessage() for record in queued] == [
+            'Retrying', 'Telegram error'
+        ]